@@ -114,6 +114,7 @@ def run_policy_iteration(exp_name, params_gt, params_policy, policy, iteration,
                  n_worker_classes=n_worker_classes,
                  params_gt=params_policy.get_param_dict(sample=False),
                  **policy)
+    a_boot = pol.model.actions.index(wlp.Action('boot'))
 
     # Begin experiment
     # TODO: Don't make assumptions about random workers / actions.
@@ -135,115 +136,119 @@ def run_policy_iteration(exp_name, params_gt, params_policy, policy, iteration,
     t = 0
     reserved = False
     budget_explore = budget * (1 - budget_reserved_frac)
-    while (budget_spent < budget and
-           not (worker_n > BOOTS_TERM and
-                all(n == 1 for n in n_actions_by_worker[-1 * BOOTS_TERM:])) and
-           simulator.worker_available() and
-           (not passive or passive_simulator.worker_available())):
-        # BUG: Line above means passive always stops before running another
-        # simulator.
-        logger.info('{} (i:{}, w:{}, b:{:.8f}/{:.8f})'.format(
-            pol, it, worker_n, budget_spent, budget))
-        if passive and passive_simulator.worker_available():
-            curr_simulator = passive_simulator
-            using_passive = True
-        else:
-            curr_simulator = simulator
-            using_passive = False
-        s = curr_simulator.new_worker()
-
-        if budget_spent >= budget_explore:
-            reserved = True
-
-        # Belief using estimated model.
-        resolve_min_worker_interval = 1 if using_passive else 10
-        resolve_max_n = None if using_passive else 10
-        logger.info('prepping worker...')
-
-        # Prep for worker.
-        pomdp_dirpath = os.path.join(
-            os.path.dirname(__file__), 'models', exp_name, str(it))
-        policy_dirpath = os.path.join(
-            os.path.dirname(__file__), 'policies', exp_name, str(it))
-        pomdp_fpath = os.path.join(
-            pomdp_dirpath, '{}-{:06d}.pomdp'.format(str(pol), worker_n))
-        policy_fpath = os.path.join(
-            policy_dirpath, '{}-{:06d}.policy'.format(str(pol), worker_n))
-        pol.prep_worker(
-            model_filepath=pomdp_fpath,
-            policy_filepath=policy_fpath,
-            history=history,
-            budget_spent=budget_spent,
-            budget_explore=budget_explore,
-            reserved=reserved,
-            resolve_min_worker_interval=resolve_min_worker_interval,
-            resolve_max_n=resolve_max_n)
-        history.new_worker()
-        logger.info('...prepped')
-        belief = pol.model.get_start_belief()
-        results.append({'iteration': it,
-                        'worker': worker_n,
-                        't': t,
-                        'policy': str(pol),
-                        'sys_t': time.clock(),
-                        'a': None,
-                        'explore': None,
-                        'reserved': reserved,
-                        's': s,
-                        'o': None,
-                        'cost': None,
-                        'r': None,
-                        'b': list(belief),
-                        'other': None})
-        worker_first_t = t
-        t += 1
-
-        while (budget_spent < budget and curr_simulator.worker_hired()):
-            if not using_passive:
-                if reserved:
-                    a = pol.get_best_action(history=history, belief=belief)
-                    explore = False
-                else:
-                    a, explore = pol.get_next_action(history, budget_spent,
-                                                     budget_explore, belief)
-                # Override policy decision and boot worker if in
-                # entered reserved portion while worker hired.
-                if not reserved and budget_spent >= budget_explore:
-                    a = pol.model.actions.index(wlp.Action('boot'))
-            else:
-                explore = False
-
-            # Simulate a step
-            if not using_passive:
-                a, s, o, (cost, r), other = simulator.sample_SOR(a=a)
+    try:
+        while (budget_spent < budget and
+               not (worker_n > BOOTS_TERM and
+                    all(n == 1 for n in n_actions_by_worker[-1 * BOOTS_TERM:])) and
+               simulator.worker_available() and
+               (not passive or passive_simulator.worker_available())):
+            # BUG: Line above means passive always stops before running another
+            # simulator.
+            logger.info('{} (i:{}, w:{}, b:{:.8f}/{:.8f})'.format(
+                pol, it, worker_n, budget_spent, budget))
+            if passive and passive_simulator.worker_available():
+                curr_simulator = passive_simulator
+                using_passive = True
             else:
-                a, s, o, (cost, r), other = passive_simulator.sample_SOR(a=None)
-                s = None
-                # TODO: Record whether following passive or not.
-            budget_spent -= cost
-            logger.info('{} (i:{}, w:{}, a:{}, o:{}, b:{:.8f}/{:.8f})'.format(
-                pol, it, worker_n, a, o, budget_spent, budget))
-            history.record(a, o, explore=explore)
-            belief = pol.model.update_belief(belief, a, o)
-
+                curr_simulator = simulator
+                using_passive = False
+            s = curr_simulator.new_worker()
+
+            if budget_spent >= budget_explore:
+                reserved = True
+
+            # Belief using estimated model.
+            resolve_min_worker_interval = 1 if using_passive else 10
+            resolve_max_n = None if using_passive else 10
+            logger.info('prepping worker...')
+
+            # Prep for worker.
+            pomdp_dirpath = os.path.join(
+                os.path.dirname(__file__), 'models', exp_name, str(it))
+            policy_dirpath = os.path.join(
+                os.path.dirname(__file__), 'policies', exp_name, str(it))
+            pomdp_fpath = os.path.join(
+                pomdp_dirpath, '{}-{:06d}.pomdp'.format(str(pol), worker_n))
+            policy_fpath = os.path.join(
+                policy_dirpath, '{}-{:06d}.policy'.format(str(pol), worker_n))
+            pol.prep_worker(
+                model_filepath=pomdp_fpath,
+                policy_filepath=policy_fpath,
+                history=history,
+                budget_spent=budget_spent,
+                budget_explore=budget_explore,
+                reserved=reserved,
+                resolve_min_worker_interval=resolve_min_worker_interval,
+                resolve_max_n=resolve_max_n)
+            history.new_worker()
+            logger.info('...prepped')
+            belief = pol.model.get_start_belief()
             results.append({'iteration': it,
                             'worker': worker_n,
                             't': t,
                             'policy': str(pol),
                             'sys_t': time.clock(),
-                            'a': a,
-                            'explore': explore,
+                            'a': None,
+                            'explore': None,
                             'reserved': reserved,
                             's': s,
-                            'o': o,
-                            'cost': cost,
-                            'r': r,
+                            'o': None,
+                            'cost': None,
+                            'r': None,
                             'b': list(belief),
-                            'other': other})
+                            'other': None})
+            worker_first_t = t
             t += 1
 
-        n_actions_by_worker.append(t - worker_first_t - 1)
-        worker_n += 1
+            while (budget_spent < budget and curr_simulator.worker_hired()):
+                if not using_passive:
+                    if reserved:
+                        a = pol.get_best_action(history=history, belief=belief)
+                        explore = False
+                    else:
+                        a, explore = pol.get_next_action(history, budget_spent,
+                                                         budget_explore, belief)
+                    # Override policy decision and boot worker if in
+                    # entered reserved portion while worker hired.
+                    if not reserved and budget_spent >= budget_explore:
+                        a = a_boot
+                else:
+                    explore = False
+
+                # Simulate a step
+                if not using_passive:
+                    a, s, o, (cost, r), other = simulator.sample_SOR(a=a)
+                else:
+                    a, s, o, (cost, r), other = passive_simulator.sample_SOR(a=None)
+                    s = None
+                    # TODO: Record whether following passive or not.
+                budget_spent -= cost
+                logger.info('{} (i:{}, w:{}, a:{}, o:{}, b:{:.8f}/{:.8f})'.format(
+                    pol, it, worker_n, a, o, budget_spent, budget))
+                history.record(a, o, explore=explore)
+                belief = pol.model.update_belief(belief, a, o)
+
+                results.append({'iteration': it,
+                                'worker': worker_n,
+                                't': t,
+                                'policy': str(pol),
+                                'sys_t': time.clock(),
+                                'a': a,
+                                'explore': explore,
+                                'reserved': reserved,
+                                's': s,
+                                'o': o,
+                                'cost': cost,
+                                'r': r,
+                                'b': list(belief),
+                                'other': other})
+                t += 1
+
+            n_actions_by_worker.append(t - worker_first_t - 1)
+            worker_n += 1
+    finally:
+        # Wait for any background solver before reading resolve times.
+        pol.close()
 
     # Record models, estimate times, and resolve times.
     models = []
@@ -274,6 +279,14 @@ def run_policy_iteration(exp_name, params_gt, params_policy, policy, iteration,
                         'type': 'resolve',
                         'duration': pol.resolve_times[worker]})
 
+    # Resolves served from the solver cache have no meaningful duration.
+    for worker in sorted(pol.resolve_cached):
+        timings.append({'iteration': iteration,
+                        'worker': worker,
+                        'policy': str(pol),
+                        'type': 'resolve_cached',
+                        'duration': None})
+
     return results, models, timings
 
 
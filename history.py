@@ -1,14 +1,32 @@
+from array import array
+
+
 class History:
     def __init__(self):
         self.history = []
+        # Actions and observations by worker, as parallel arrays.
+        self._actions = []
+        self._observations = []
 
     def new_worker(self):
         """Initialize new worker"""
         self.history.append([])
+        self._actions.append(array('i'))
+        self._observations.append(array('i'))
 
     def record(self, action, observation, explore=None):
         """Record action and subsequent observation"""
         self.history[-1].append((action, observation, explore))
+        self._actions[-1].append(action)
+        self._observations[-1].append(observation)
+
+    def actions(self, worker):
+        """Return array of actions taken with worker"""
+        return self._actions[worker]
+
+    def observations(self, worker):
+        """Return array of observations received from worker"""
+        return self._observations[worker]
 
     def n_workers(self):
         return len(self.history)
@@ -6,20 +6,133 @@ pomdpsol-aitoolbox for 'aitoolbox' policies.
 """
 from __future__ import division
 import collections
+import errno
 import os
 import time
 import copy
 import random
 import math
+import hashlib
+import shutil
 import subprocess
+import tempfile
+from cStringIO import StringIO
+from distutils.spawn import find_executable
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from .pomdp import POMDPPolicy, POMDPModel
-from . import util
 from .util import ensure_dir, equation_safe_filename
 from . import work_learn_problem as wlp
 from . import param
 
 ZMDP_ALIAS = os.environ.get('ZMDP_ALIAS', 'pomdpsol-zmdp')
+# Wall-clock timer (time.perf_counter is unavailable before Python 3.3).
+timer = getattr(time, 'perf_counter', time.time)
+_solver_paths = dict()
+_solver_stamps = dict()
+
+
+def solver_path(name):
+    """Return absolute path of a solver executable on $PATH.
+
+    Solvers launched by absolute path with close_fds=False can be started
+    with posix_spawn rather than fork/exec on Python 3.8+. Returns name
+    unchanged if the executable is not found.
+
+    """
+    if name not in _solver_paths:
+        _solver_paths[name] = find_executable(name) or name
+    return _solver_paths[name]
+
+
+def solver_stamp(name):
+    """Return string identifying a solver executable and its version.
+
+    Uses the absolute path, size, and modification time of the executable,
+    so cached solutions are not reused after the solver is rebuilt.
+
+    """
+    if name not in _solver_stamps:
+        path = solver_path(name)
+        try:
+            st = os.stat(path)
+            _solver_stamps[name] = '{} {} {}'.format(
+                path, st.st_size, st.st_mtime)
+        except OSError:
+            _solver_stamps[name] = path
+    return _solver_stamps[name]
+
+
+def call_timed(args, input_str=None):
+    """Run a subprocess and return its user plus system time.
+
+    The child is reaped with os.wait4, so only its own resource usage is
+    counted, even if other child processes finish meanwhile.
+
+    Args:
+        args (list):                Command line arguments.
+        input_str (Optional[str]):  String written to standard input.
+
+    Returns:
+        duration (float)
+
+    Raises:
+        subprocess.CalledProcessError: If the process fails. Its standard
+            error is printed first.
+
+    """
+    err = tempfile.TemporaryFile()
+    try:
+        with open(os.devnull, 'w') as devnull:
+            p = subprocess.Popen(
+                args,
+                stdin=subprocess.PIPE if input_str is not None else None,
+                stdout=devnull, stderr=err, close_fds=False)
+        if input_str is not None:
+            # The process may exit before reading all of its input.
+            try:
+                p.stdin.write(input_str)
+            except IOError as e:
+                if e.errno != errno.EPIPE:
+                    raise
+            try:
+                p.stdin.close()
+            except IOError as e:
+                if e.errno != errno.EPIPE:
+                    raise
+        _, status, ru = os.wait4(p.pid, 0)
+        if os.WIFSIGNALED(status):
+            p.returncode = -os.WTERMSIG(status)
+        else:
+            p.returncode = os.WEXITSTATUS(status)
+        if p.returncode != 0:
+            err.seek(0)
+            print err.read()
+            raise subprocess.CalledProcessError(p.returncode, args)
+    finally:
+        err.close()
+    return ru.ru_utime + ru.ru_stime
+
+
+def copy_params(d):
+    """Copy a dictionary of parameter arrays (or lists).
+
+    Faster than copy.deepcopy for flat dictionaries of numeric arrays.
+    Nested dictionaries are copied one level deep.
+
+    """
+    if d is None:
+        return None
+    res = dict()
+    for k, v in d.iteritems():
+        if isinstance(v, np.ndarray):
+            res[k] = v.copy()
+        elif isinstance(v, dict):
+            res[k] = dict((k1, copy.copy(v1)) for k1, v1 in v.iteritems())
+        else:
+            res[k] = copy.copy(v)
+    return res
+
 
 class Policy:
     """Policy class
@@ -38,6 +151,10 @@ class Policy:
         self.thompson = bool(kwargs.get('thompson', False))
         self.hyperparams = kwargs.get('hyperparams', None)
         self.desired_accuracy = params_gt.get('desired_accuracy', None)
+        if isinstance(self.epsilon, basestring):
+            self._epsilon_code = compile(self.epsilon, '<epsilon>', 'eval')
+        else:
+            self._epsilon_code = None
 
         if self.rl_p():
             name = kwargs['hyperparams']
@@ -55,6 +172,30 @@ class Policy:
         else:
             self.model = POMDPModel(n_worker_classes, params=params_gt)
 
+        # Action indices used when selecting actions.
+        actions = self.model.actions
+        self._a_ask = actions.index(wlp.Action('ask'))
+        self._a_boot = actions.index(wlp.Action('boot'))
+        if wlp.Action('exp') in actions:
+            self._a_exp = actions.index(wlp.Action('exp'))
+        else:
+            self._a_exp = None
+        self._quiz_idx = tuple(
+            i for i, a in enumerate(actions) if a.is_quiz())
+        self._tell_idx = tuple(
+            i for i, a in enumerate(actions) if a.name == 'tell')
+        self._quiz_set = frozenset(self._quiz_idx)
+        # Entry i lists the actions that may follow action i. The last
+        # entry lists the actions that may be taken first.
+        self._valid_after = [
+            [j for j, a in enumerate(actions) if a.valid_after(last_action)]
+            for last_action in list(actions) + [None]]
+
+        # Answer characters for each observation ('?' for no answer).
+        self._obs_answers = tuple(
+            '?' if o in ('term', 'null') else o for
+            o in self.model.observations)
+
         if self.policy in ('appl', 'zmdp'):
             self.discount = kwargs.get('discount', default_discount)
             self.timeout = kwargs.get('timeout', None)
@@ -64,26 +205,48 @@ class Policy:
         elif self.policy == 'test_and_boot':
             self.teach_type = kwargs.get('teach_type', None)
             self.n_teach = kwargs.get('n_teach', 0)
+            if self.teach_type == 'exp':
+                self._teach_idx = self._quiz_idx
+            elif self.teach_type == 'tell':
+                self._teach_idx = self._tell_idx
+            else:
+                self._teach_idx = ()
             self.n_blocks = kwargs.get('n_blocks', None)
             if self.n_blocks != 0:
                 self.n_test = kwargs['n_test']
                 self.n_work = kwargs['n_work']
                 self.accuracy = kwargs['accuracy']
-                n_test_actions = len(
-                    [a for a in self.model.actions if a.is_quiz()])
+                n_test_actions = len(self._quiz_idx)
                 self.accuracy_window = kwargs.get('accuracy_window', None)
                 if self.accuracy_window is None:
                     self.accuracy_window = self.n_test * n_test_actions
             self.final_action = kwargs.get('final_action', 'work')
         elif self.policy != 'work_only':
             raise NotImplementedError
+        # Pipe models to the solver instead of writing model files. Off by
+        # default, since solvers may detect the model format from the
+        # file extension.
+        self.solver_stdin = kwargs.get('solver_stdin', False)
+        # Resolve in a background thread, using the previous policy
+        # until the new one is ready.
+        self.solve_async = kwargs.get('solve_async', False)
+        # Directory for caching solver output across runs (off if None).
+        self.solver_cache_dir = kwargs.get('solver_cache_dir', None)
+        # Processes for random restarts when re-estimating the model.
+        self.resolve_processes = kwargs.get('resolve_processes', 1)
 
         self.params_estimated = dict()
         self.hparams_estimated = dict()
         self.estimate_times = dict()
         self.resolve_times = dict()
+        self.resolve_cached = set()
         self.external_policy = None
         self.use_explore_policy = False
+        self._solver_cache = dict()
+        self._worker_stats = dict()
+        self._solver_pool = None
+        self._solver_future = None
+        self._str = None
 
     def rl_p(self):
         """Policy does reinforcement learning."""
@@ -100,12 +263,12 @@ class Policy:
         checks.
 
         """
-        # Put some useful variable abbreviations in the namespace.
-        w = worker
-        f = budget_frac
-        e = math.e
-        if isinstance(self.epsilon, basestring):
-            return eval(self.epsilon)
+        if self._epsilon_code is not None:
+            # Put some useful variable abbreviations in the namespace.
+            return eval(self._epsilon_code, globals(),
+                        {'worker': worker, 'w': worker, 't': t,
+                         'budget_frac': budget_frac, 'f': budget_frac,
+                         'e': math.e})
         else:
             return self.epsilon
 
@@ -133,12 +296,19 @@ class Policy:
 
         Don't resolve more frequently than resolve_min_worker_interval.
 
+        If self.solve_async is set and a policy already exists, the solver
+        runs in the background and the new policy is swapped in by
+        get_best_action once it is ready. Call close() when done to wait
+        for the last background solve and record its resolve time.
+
         Args:
             history (.history.History): History of workers.
                 IMPORTANT: Do not call .history.History.new_worker() before
                 running this function or the worker count will be incorrect.
             resolve_random_restarts (int): Number of random restarts to use
-                when re-estimating model.
+                when re-estimating model. Restarts are run in
+                self.resolve_processes processes (always 1 inside a
+                daemonic pool worker, as in exp.run_experiment).
             previous_workers (Optional[int]): Number of previous workers.
                 Defaults to one less than number of workers in history object.
 
@@ -157,34 +327,80 @@ class Policy:
         resolve_p = (self.policy in ('appl', 'zmdp', 'aitoolbox') and
                      (self.external_policy is None or
                       (self.rl_p() and not self.use_explore_policy)))
-        if self.resolve_times:
-            if resolve_min_worker_interval is not None and worker - max(self.resolve_times) < resolve_min_worker_interval:
+        self.collect_solver()
+        resolve_workers = set(self.resolve_times) | self.resolve_cached
+        if self._solver_future is not None:
+            resolve_workers.add(self._solver_future[0])
+        if resolve_workers:
+            if resolve_min_worker_interval is not None and worker - max(resolve_workers) < resolve_min_worker_interval:
                 resolve_p = False
-            if resolve_max_n is not None and len(self.resolve_times) >= resolve_max_n:
+            if resolve_max_n is not None and len(resolve_workers) >= resolve_max_n:
                 resolve_p = False
 
         estimate_p = self.rl_p() and resolve_p
         model = self.model
         if estimate_p:
-            start = time.clock()
+            start = timer()
             model.estimate(history=history,
                            last_params=(len(self.params_estimated) > 0),
-                           random_restarts=resolve_random_restarts)
+                           random_restarts=resolve_random_restarts,
+                           processes=self.resolve_processes)
             if self.thompson:
                 model.thompson_sample()
-            self.estimate_times[worker] = time.clock() - start
-            self.params_estimated[worker] = copy.deepcopy(
+            self.estimate_times[worker] = timer() - start
+            self.params_estimated[worker] = copy_params(
                 model.get_params_est())
-            self.hparams_estimated[worker] = copy.deepcopy(model.hparams)
+            self.hparams_estimated[worker] = copy_params(model.hparams)
         if resolve_p:
-            utime1, stime1, cutime1, cstime1, _ = os.times()
-            self.external_policy = self.run_solver(
-                model_filepath=model_filepath, policy_filepath=policy_filepath)
-            utime2, stime2, cutime2, cstime2, _ = os.times()
-            # All solvers are run as subprocesses, so count elapsed
-            # child process time.
-            self.resolve_times[worker] = cutime2 - cutime1 + \
-                                         cstime2 - cstime1
+            model_str = self.get_model_str()
+            if self.solve_async and self.external_policy is not None:
+                self.collect_solver(wait=True)
+                if self._solver_pool is None:
+                    self._solver_pool = ThreadPool(processes=1)
+                self._solver_future = (
+                    worker,
+                    self._solver_pool.apply_async(
+                        self.run_solver,
+                        (model_filepath, policy_filepath, model_str)))
+            else:
+                self.record_resolve(worker, self.run_solver(
+                    model_filepath, policy_filepath, model_str))
+
+    def collect_solver(self, wait=False):
+        """Use policy from background solver if it has finished.
+
+        Args:
+            wait (bool):    Wait for the background solver to finish.
+
+        """
+        if self._solver_future is None:
+            return
+        worker, res = self._solver_future
+        if wait or res.ready():
+            self._solver_future = None
+            self.record_resolve(worker, res.get())
+
+    def record_resolve(self, worker, result):
+        """Use policy from solver and record its resolve time.
+
+        Args:
+            worker (int):       Worker the policy was solved for.
+            result (tuple):     Return value of run_solver.
+
+        """
+        self.external_policy, duration = result
+        if duration is None:
+            self.resolve_cached.add(worker)
+        else:
+            self.resolve_times[worker] = duration
+
+    def close(self):
+        """Wait for any background solver and shut down its thread."""
+        self.collect_solver(wait=True)
+        if self._solver_pool is not None:
+            self._solver_pool.close()
+            self._solver_pool.join()
+            self._solver_pool = None
 
     def get_next_action(self, history,
                         budget_spent, budget_explore, belief=None,
@@ -215,10 +431,11 @@ class Policy:
                 history, budget_spent, budget_explore, belief)
             return next_a, True
         else:
-            return self.get_best_action(history, belief), False
+            return self.get_best_action(history, belief,
+                                        valid_actions=valid_actions), False
 
 
-    def get_best_action(self, history, belief=None):
+    def get_best_action(self, history, belief=None, valid_actions=None):
         """Get best action according to policy.
 
         If policy requires an external_policy, assumes it already exists.
@@ -230,46 +447,28 @@ class Policy:
 
         Args:
             history (History object):   Defined in history.py.
+            valid_actions (Optional[list]): Valid action indices, if
+                already computed by get_valid_actions for this history.
 
         Returns: Action index.
 
         """
-        valid_actions = self.get_valid_actions(history)
-        model = self.model
-        a_ask = model.actions.index(wlp.Action('ask'))
-        a_boot = model.actions.index(wlp.Action('boot'))
-        worker = history.n_workers() - 1
-        current_AO = history.history[-1]
-        if len(current_AO) == 0:
-            current_actions = []
-            current_observations = []
-        else:
-            current_actions, current_observations, _ = zip(*current_AO)
+        if valid_actions is None:
+            valid_actions = self.get_valid_actions(history)
+        a_ask = self._a_ask
+        a_boot = self._a_boot
+        current_actions = history.actions(-1)
+        current_observations = history.observations(-1)
         n_actions = len(current_actions)
         if self.policy == 'work_only':
             return a_ask
         elif self.policy == 'test_and_boot':
+            stats = self.update_worker_stats(history)
             if self.teach_type is not None:
                 # Make sure to teach each skill at least n times.
                 # Select skills in random order, but teach each skill as a batch.
-                if self.teach_type == 'exp':
-                    teach_actions = [i for i, a in enumerate(model.actions) if
-                                     a.is_quiz()]
-                    teach_counts = collections.defaultdict(int)
-                    for i in xrange(len(current_actions) - 1):
-                        a1 = model.actions[current_actions[i]]
-                        a2 = model.actions[current_actions[i + 1]]
-                        if a1.is_quiz() and a2.name == 'exp':
-                            teach_counts[current_actions[i]] += 1
-                elif self.teach_type == 'tell':
-                    teach_actions = [i for i, a in enumerate(model.actions) if
-                                     a.name == 'tell']
-                    teach_counts = collections.Counter(
-                        [a for a in current_actions if a in teach_actions])
-                teach_actions_remaining = [a for a in teach_actions if
-                                           teach_counts[a] < self.n_teach]
-                teach_actions_in_progress = [a for a in teach_actions_remaining if
-                                             teach_counts[a] > 0]
+                teach_actions_remaining = stats['teach_remaining']
+                teach_actions_in_progress = stats['teach_in_progress']
                 if n_actions == 0:
                     if teach_actions_remaining:
                         return random.choice(teach_actions_remaining)
@@ -279,7 +478,7 @@ class Policy:
                     last_action = current_actions[-1]
                     if (self.teach_type == 'exp' and
                             last_action in teach_actions_remaining):
-                        return model.actions.index(wlp.Action('exp'))
+                        return self._a_exp
                     elif len(teach_actions_in_progress) > 0:
                         return random.choice(teach_actions_in_progress)
                     elif len(teach_actions_remaining) > 0:
@@ -291,11 +490,9 @@ class Policy:
                 a_final = a_boot
             else:
                 raise Exception('Unexpected final action type')
-            n_work_actions = len([a for a in current_actions if
-                                  a == a_ask])
+            n_work_actions = stats['n_work']
             # If all blocks done, take final action.
-            test_actions = [i for i, a in enumerate(model.actions) if
-                            a.is_quiz()]
+            test_actions = self._quiz_idx
             if self.n_blocks is not None:
                 if self.n_blocks == 0:
                     return a_final
@@ -303,21 +500,16 @@ class Policy:
                 n_blocks_completed = len(current_actions) / block_length
                 if n_blocks_completed >= self.n_blocks:
                     return a_final
-            last_action_block = util.last_true(
-                current_actions, lambda a: model.actions[a].is_quiz())
-            test_counts = collections.Counter(last_action_block)
             if self.n_work == 0 or n_work_actions % self.n_work == 0:
-                test_actions_remaining = [a for a in test_actions if
-                                          test_counts[a] < self.n_test]
+                test_actions_remaining = stats['test_remaining']
                 if len(test_actions_remaining) == 0:
                     # Testing done. Check accuracy.
                     test_answers = current_observations[
                         -1 * self.accuracy_window:]
-                    assert not any(model.observations[i] in ['term', 'null'] for
-                        i in test_answers)
-                    concat_answers = ''.join(model.observations[i] for
-                                             i in test_answers)
-                    accuracy = sum(v == 'r' for v in concat_answers) / len(concat_answers)
+                    concat_answers = ''.join(
+                        [self._obs_answers[i] for i in test_answers])
+                    assert '?' not in concat_answers
+                    accuracy = concat_answers.count('r') / len(concat_answers)
                     if accuracy >= self.accuracy:
                         return a_ask
                     else:
@@ -327,50 +519,219 @@ class Policy:
             else:
                 return a_ask
         elif self.policy in ('appl', 'aitoolbox', 'zmdp'):
+            self.collect_solver()
             rewards = self.external_policy.get_action_rewards(belief)
-            valid_actions_with_rewards = set(valid_actions).intersection(
-                set(rewards))
-            if len(valid_actions_with_rewards) == 0:
+            A = len(self.model.actions)
+            rewards_arr = np.full(A, -np.inf)
+            rewards_arr[rewards.keys()] = rewards.values()
+            mask = np.zeros(A, dtype=bool)
+            mask[rewards.keys()] = True
+            valid_mask = np.zeros(A, dtype=bool)
+            valid_mask[valid_actions] = True
+            mask &= valid_mask
+            if not mask.any():
                 raise Exception('No valid actions in policy')
-            max_reward = max(rewards.itervalues())
-            valid_rewards = dict((a, rewards[a]) for a in valid_actions_with_rewards)
-            max_valid_reward = max(valid_rewards.itervalues())
-            if max_reward > max_valid_reward:
+            valid_rewards = np.where(mask, rewards_arr, -np.inf)
+            max_valid_reward = valid_rewards.max()
+            if rewards_arr.max() > max_valid_reward:
                 print 'Warning: best reward not available'
             # Take random best action.
-            best_valid_action = random.choice(
-                [a for a in valid_rewards if
-                 valid_rewards[a] == max_valid_reward])
-            return best_valid_action
+            best_valid_action = random.choice(np.flatnonzero(
+                mask & (valid_rewards == max_valid_reward)))
+            return int(best_valid_action)
         else:
             raise NotImplementedError
 
-    def run_solver(self, model_filepath, policy_filepath):
+    def update_worker_stats(self, history):
+        """Return action counts for the current worker.
+
+        Counts are updated incrementally with the actions recorded since
+        the last call, and reset when a new worker starts. Tuples of
+        remaining actions are only rebuilt when a count crosses a
+        threshold. Used by test_and_boot policies.
+
+        Returns:
+            stats (dict):   Dictionary with keys
+                'n_t':          Number of actions counted.
+                'n_work':       Number of work actions.
+                'teach_counts': Counter of teaching actions (quiz actions
+                                followed by an explanation, or tell actions).
+                'test_counts':  Counter of actions in the current block
+                                of quiz actions.
+                'last_action':  Last action counted (or None).
+                'teach_remaining':      Teaching actions taught fewer
+                                        than n_teach times.
+                'teach_in_progress':    Remaining teaching actions
+                                        taught at least once.
+                'test_remaining':       Quiz actions taken fewer than
+                                        n_test times in current block.
+
+        """
+        worker = history.n_workers() - 1
+        current_actions = history.actions(-1)
+        n_test = getattr(self, 'n_test', 0)
+        stats = self._worker_stats.get(worker, None)
+        if stats is None or stats['n_t'] > len(current_actions):
+            stats = {'n_t': 0,
+                     'n_work': 0,
+                     'teach_counts': collections.Counter(),
+                     'test_counts': collections.Counter(),
+                     'last_action': None}
+            self._worker_stats = {worker: stats}
+            teach_changed = test_changed = True
+        else:
+            teach_changed = test_changed = False
+        teach_counts = stats['teach_counts']
+        test_counts = stats['test_counts']
+        for a in current_actions[stats['n_t']:]:
+            if a == self._a_ask:
+                stats['n_work'] += 1
+            if a in self._quiz_set:
+                test_counts[a] += 1
+                test_changed |= test_counts[a] == n_test
+            elif test_counts:
+                test_counts.clear()
+                test_changed = True
+            if (self.teach_type == 'exp' and a == self._a_exp and
+                    stats['last_action'] in self._quiz_set):
+                teach_a = stats['last_action']
+            elif self.teach_type == 'tell' and a in self._tell_idx:
+                teach_a = a
+            else:
+                teach_a = None
+            if teach_a is not None:
+                teach_counts[teach_a] += 1
+                teach_changed |= teach_counts[teach_a] in (1, self.n_teach)
+            stats['last_action'] = a
+            stats['n_t'] += 1
+        if teach_changed:
+            stats['teach_remaining'] = tuple(
+                a for a in self._teach_idx if teach_counts[a] < self.n_teach)
+            stats['teach_in_progress'] = tuple(
+                a for a in stats['teach_remaining'] if teach_counts[a] > 0)
+        if test_changed:
+            stats['test_remaining'] = tuple(
+                a for a in self._quiz_idx if test_counts[a] < n_test)
+        return stats
+
+    def get_model_str(self):
+        """Return model serialized in the format read by the POMDP solver."""
+        buf = StringIO()
+        if self.policy == 'aitoolbox':
+            self.model.write_txt(buf)
+        else:
+            self.model.write_pomdp(buf, discount=self.discount)
+        return buf.getvalue()
+
+    def run_solver(self, model_filepath, policy_filepath, model_str=None):
         """Run POMDP solver.
-        
+
+        Solutions are cached in memory by a hash of the solver, its
+        arguments, and the serialized model, so the solver is only run when
+        the model has not been solved before. If self.solver_cache_dir is
+        set, solutions are also cached there across runs. On a cache hit,
+        the cached policy is written to policy_filepath.
+
+        Args:
+            model_filepath (str):       Path for input to POMDP solver.
+            policy_filepath (str):      Path for computed policy.
+            model_str (Optional[str]):  Serialized model. Defaults to
+                                        serializing self.model.
+
+        Returns:
+            tuple(policy, duration):
+                policy (POMDPPolicy)
+                duration (float):   User plus system time of the solver
+                                    subprocess, or None if the policy was
+                                    taken from the cache.
+
+        """
+        if model_str is None:
+            model_str = self.get_model_str()
+
+        args = self.get_solver_args('', '')
+        key = hashlib.sha1(
+            ' '.join([solver_stamp(args[0])] + args[1:]) + '\n' +
+            model_str).hexdigest()
+        if key in self._solver_cache:
+            policy, policy_str = self._solver_cache[key]
+            with open(policy_filepath, 'w') as f:
+                f.write(policy_str)
+            return policy, None
+
+        if self.solver_cache_dir is not None:
+            cache_filepath = os.path.join(self.solver_cache_dir,
+                                          '{}.policy'.format(key))
+        else:
+            cache_filepath = None
+        if cache_filepath is not None and os.path.exists(cache_filepath):
+            shutil.copyfile(cache_filepath, policy_filepath)
+            duration = None
+        else:
+            duration = self.call_solver(model_str, model_filepath,
+                                        policy_filepath)
+            if cache_filepath is not None:
+                self.write_solver_cache(policy_filepath, cache_filepath)
+        with open(policy_filepath, 'r') as f:
+            policy_str = f.read()
+        policy = self.load_solver_policy(policy_filepath)
+        self._solver_cache[key] = (policy, policy_str)
+        return policy, duration
+
+    def write_solver_cache(self, policy_filepath, cache_filepath):
+        """Copy solver output to the on-disk cache.
+
+        Copies rather than links, since solvers overwrite their output path
+        in place, and renames so other processes never read a partial
+        cache file.
+
+        """
+        ensure_dir(self.solver_cache_dir)
+        fd, tmp_filepath = tempfile.mkstemp(dir=self.solver_cache_dir,
+                                            suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(policy_filepath, tmp_filepath)
+            os.rename(tmp_filepath, cache_filepath)
+        except:
+            os.remove(tmp_filepath)
+            raise
+
+    def call_solver(self, model_str, model_filepath, policy_filepath):
+        """Run POMDP solver subprocess.
+
+        The model is written to model_filepath, or piped to the solver's
+        standard input if self.solver_stdin is set.
+
         Args:
+            model_str (str):            Serialized model.
             model_filepath (str):       Path for input to POMDP solver.
             policy_filepath (str):      Path for computed policy.
 
         Returns:
-            policy (POMDPPolicy)
+            duration (float):   User plus system time of the solver.
 
         """
+        if self.solver_stdin:
+            args = self.get_solver_args('/dev/stdin', policy_filepath)
+            args[0] = solver_path(args[0])
+            return call_timed(args, input_str=model_str)
+        with open(model_filepath, 'w') as f:
+            f.write(model_str)
+        args = self.get_solver_args(model_filepath, policy_filepath)
+        args[0] = solver_path(args[0])
+        return call_timed(args)
+
+    def get_solver_args(self, model_filepath, policy_filepath):
+        """Return command line arguments for the POMDP solver."""
         model = self.model
         if self.policy == 'appl':
-            with open(model_filepath, 'w') as f:
-                model.write_pomdp(f, discount=self.discount)
             args = ['pomdpsol-appl',
                     model_filepath,
                     '-o', policy_filepath]
             if self.timeout is not None:
                 args += ['--timeout', str(self.timeout)]
-            _ = subprocess.check_output(args)
-            return POMDPPolicy(policy_filepath,
-                               file_format='policyx')
         elif self.policy == 'aitoolbox':
-            with open(model_filepath, 'w') as f:
-                model.write_txt(f)
             args = ['pomdpsol-aitoolbox',
                     '--input', model_filepath,
                     '--output', policy_filepath,
@@ -379,41 +740,46 @@ class Policy:
                     '--n_states', str(len(model.states)),
                     '--n_actions', str(len(model.actions)),
                     '--n_observations', str(len(model.observations))]
-            _ = subprocess.check_output(args)
-            return POMDPPolicy(policy_filepath,
-                               file_format='aitoolbox',
-                               n_states=len(model.states))
         elif self.policy == 'zmdp':
-            with open(model_filepath, 'w') as f:
-                model.write_pomdp(f, discount=self.discount)
             args = [ZMDP_ALIAS,
                     'solve', model_filepath,
                     '-o', policy_filepath]
             if self.timeout is not None:
                 args += ['-t', str(self.timeout)]
-            _ = subprocess.check_output(args)
+        else:
+            raise NotImplementedError
+        return args
+
+    def load_solver_policy(self, policy_filepath):
+        """Load policy file written by the POMDP solver."""
+        if self.policy == 'appl':
+            return POMDPPolicy(policy_filepath,
+                               file_format='policyx')
+        elif self.policy == 'aitoolbox':
+            return POMDPPolicy(policy_filepath,
+                               file_format='aitoolbox',
+                               n_states=len(self.model.states))
+        elif self.policy == 'zmdp':
             return POMDPPolicy(policy_filepath,
                                file_format='zmdp',
-                               n_states=len(model.states))
+                               n_states=len(self.model.states))
+        else:
+            raise NotImplementedError
 
 
     def get_valid_actions(self, history):
         """Return valid action indices based on the history."""
-        current_AO = history.history[-1]
-        if len(current_AO) == 0:
-            current_actions = []
-            current_observations = []
+        current_actions = history.actions(-1)
+        if len(current_actions) == 0:
+            last_action = len(self.model.actions)
         else:
-            current_actions, current_observations, _ = zip(*current_AO)
-
-        try:
-            last_action = self.model.actions[current_actions[-1]]
-        except IndexError:
-            last_action = None
-        return [i for i, a in enumerate(self.model.actions) if
-                a.valid_after(last_action)]
+            last_action = current_actions[-1]
+        return list(self._valid_after[last_action])
 
     def __str__(self):
+        # Settings used in the name don't change after initialization.
+        if self._str is not None:
+            return self._str
         if self.policy in ('appl', 'zmdp'):
             s = self.policy + '-d{:.3f}'.format(self.discount)
             if self.timeout is not None:
@@ -451,4 +817,5 @@ class Policy:
             s += '-cl{}'.format(self.model.n_worker_classes)
             if self.desired_accuracy is not None:
                 s += '-acc{:.2f}'.format(self.desired_accuracy)
+        self._str = s
         return s
@@ -2,7 +2,9 @@
 
 from __future__ import division
 import copy
+import functools as ft
 import logging
+import multiprocessing
 import random
 import xml.etree.ElementTree as ET
 import numpy as np
@@ -610,27 +612,44 @@ class POMDPModel:
         S = len(self.states)
         A = len(self.actions)
         O = len(self.observations)
-        ess_t = np.zeros((S, A, S))
-        ess_o = np.zeros((S, A, O))
+        ess_t = np.zeros((A, S, S))
+        ess_o = np.zeros((A, O, S))
         ess_i = np.zeros((S))
-        for worker, m in enumerate(log_marginals):
+        workers = [w for w in xrange(history.n_workers()) if
+                   history.n_t(w) > 0]
+        for worker, m, pm in zip(workers, log_marginals,
+                                 log_pairwise_marginals):
+            actions, observations = history_arrays(history, worker)
             m_norm = np.exp(m - logsumexp(m, axis=1, keepdims=True))
-            T = history.n_t(worker)
-            for t in xrange(T):
-                for s in xrange(S):
-                    a, o, _ = history.history[worker][t]
-                    ess_o[s][a][o] += m_norm[t + 1][s]
+            pm_norm = np.exp(pm - logsumexp(pm, axis=(1, 2), keepdims=True))
+            np.add.at(ess_o, (actions, observations), m_norm[1:])
+            np.add.at(ess_t, actions, pm_norm)
             ess_i += m_norm[0, :]
+        return (ess_t.transpose(1, 0, 2), ess_o.transpose(2, 0, 1), ess_i)
 
-        for worker, pm in enumerate(log_pairwise_marginals):
-            pm_norm = np.exp(pm - logsumexp(pm, axis=(1, 2), keepdims=True))
-            T = history.n_t(worker)
-            for t in xrange(T):
-                a, o, _ = history.history[worker][t]
-                for s in xrange(S):
-                    for s1 in xrange(S):
-                        ess_t[s][a][s1] += pm_norm[t][s][s1]
-        return ess_t, ess_o, ess_i
+    def get_log_tables(self, params):
+        """Return log transition, observation, and start probabilities.
+
+        Returns:
+            log_t (|S|.|A|.|S| array):  Log transition probabilities.
+            log_o (|S|.|A|.|O| array):  Log observation probabilities.
+            log_i (|S| array):          Log start probabilities.
+
+        """
+        S = len(self.states)
+        A = len(self.actions)
+        O = len(self.observations)
+        p_t = np.zeros((S, A, S))
+        p_o = np.zeros((S, A, O))
+        for s in xrange(S):
+            for a in xrange(A):
+                for s1 in xrange(S):
+                    p_t[s, a, s1] = self.get_transition(s, a, s1, params)
+                for o in xrange(O):
+                    p_o[s, a, o] = self.get_observation(s, a, o, params)
+        p_i = np.array(self.get_start_belief(params))
+        with np.errstate(divide='ignore'):
+            return log(p_t), log(p_o), log(p_i)
 
     def get_unnormalized_marginals(self, params, history):
         """Estimate unnormalized marginals from provided model parameters
@@ -648,61 +667,19 @@ class POMDPModel:
                 log_likelihood:         Log-likelihood 
         
         """
-        S = len(self.states)
+        log_t, log_o, log_i = self.get_log_tables(params)
         ll = 0
         log_marginals = []
         log_pairwise_marginals = []
-        for worker_AO in history.history:
-            T = len(worker_AO)
-            if T == 0:
+        for worker in xrange(history.n_workers()):
+            if history.n_t(worker) == 0:
                 continue
-
-            # Forward-backward init.
-            alpha = np.zeros((T + 1, S))
-            beta = np.zeros((T + 1, S))
-            for s in xrange(S):
-                p_i = self.get_start_probability(s, params)
-                alpha[0][s] = log(p_i)
-                beta[T][s] = log(1.0)
-
-            # Forward.
-            for t in xrange(T):
-                a, o, _ = worker_AO[t]
-                for s1 in xrange(S):
-                    v = []
-                    for s0 in xrange(S):
-                        p_t = self.get_transition(s0, a, s1, params)
-                        p_o = self.get_observation(s1, a, o, params)
-                        v.append(alpha[t][s0] + log(p_t) + log(p_o))
-                    alpha[t + 1][s1] = logsumexp(v)
-
-            # Backward.
-            for t in reversed(xrange(T)):
-                a, o, _ = worker_AO[t]
-                for s0 in xrange(S):
-                    v = []
-                    for s1 in xrange(S):
-                        p_t = self.get_transition(s0, a, s1, params)
-                        p_o = self.get_observation(s1, a, o, params)
-                        v.append(beta[t + 1][s1] + log(p_t) + log(p_o))
-                    beta[t][s0] = logsumexp(v)
-
+            actions, observations = history_arrays(history, worker)
+            alpha, beta, pm, worker_ll = forward_backward(
+                log_t, log_o, log_i, actions, observations)
             log_marginals.append(alpha + beta)
-
-            # Make pairwise marginals
-            pm = np.zeros((T, S, S))
-            for t in xrange(T):
-                a, o, _ = worker_AO[t]
-                for s in xrange(S):
-                    for s1 in xrange(S):
-                        p_t = self.get_transition(s, a, s1, params)
-                        p_o = self.get_observation(s1, a, o, params)
-                        pm[t][s][s1] = alpha[t][s] + log(p_t) + log(p_o) + \
-                            beta[t + 1][s1]  # BUG: should this be s1 or s
             log_pairwise_marginals.append(pm)
-
-            # Update likelihood
-            ll += logsumexp(alpha[T, :])
+            ll += worker_ll
 
         return log_marginals, log_pairwise_marginals, ll
 
@@ -776,14 +753,22 @@ class POMDPModel:
         return params, hparams, ll
 
     def estimate(self, history, last_params=True, random_restarts=1,
-                 ll_max_improv=0.001):
+                 ll_max_improv=0.001, processes=1):
         """Estimate parameters from history.
 
+        Random restarts are run in parallel when more than one process is
+        used. Parallel restarts are seeded from the global numpy random
+        state, so results differ from serial restarts.
+
         Args:
             history: History object.
             last_params: Initialize from last parameter values.
             random_restarts: Number of random initializations to perform.
             ll_max_improv: Threshold of % log-likelihood improvement.
+            processes: Number of processes for random restarts. Use None
+                for one per restart, up to the number of CPUs. Always 1
+                when called from a daemonic process (e.g. a pool worker),
+                which cannot start child processes.
 
         Returns:
             ll_best: Final log likelihood
@@ -793,6 +778,10 @@ class POMDPModel:
         params_best = None
         hparams_best = None
         ll_best = float('-inf')
+        if multiprocessing.current_process().daemon:
+            processes = 1
+        elif processes is None:
+            processes = min(random_restarts, multiprocessing.cpu_count())
 
         # Run EM.
         if last_params:
@@ -802,9 +791,23 @@ class POMDPModel:
                 params_best = params
                 hparams_best = hparams
                 ll_best = ll
-        for i in xrange(random_restarts):
-            params, hparams, ll = self.estimate_once(
-                history, random_init=True, ll_max_improv=ll_max_improv)
+        if processes > 1 and random_restarts > 1:
+            seeds = np.random.randint(np.iinfo(np.int32).max,
+                                      size=random_restarts)
+            pool = multiprocessing.Pool(processes=processes,
+                                        initializer=util.init_worker)
+            try:
+                f = ft.partial(util.run_functor, estimate_restart)
+                results = pool.map(f, [(self, history, seed, ll_max_improv)
+                                       for seed in seeds])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = (self.estimate_once(
+                history, random_init=True, ll_max_improv=ll_max_improv) for
+                       i in xrange(random_restarts))
+        for params, hparams, ll in results:
             if ll > ll_best:
                 params_best = params
                 hparams_best = hparams
@@ -821,6 +824,57 @@ class POMDPModel:
             self.params[p] = np.random.dirichlet(d[p])
 
 
+def history_arrays(history, worker):
+    """Return arrays of actions and observations for a worker."""
+    actions = np.array(history.actions(worker), dtype=int)
+    observations = np.array(history.observations(worker), dtype=int)
+    return actions, observations
+
+
+def forward_backward(log_t, log_o, log_i, actions, observations):
+    """Run forward-backward on a single action-observation sequence.
+
+    Args:
+        log_t (|S|.|A|.|S| array):  Log transition probabilities.
+        log_o (|S|.|A|.|O| array):  Log observation probabilities.
+        log_i (|S| array):          Log start probabilities.
+        actions (|T| array):        Action indices.
+        observations (|T| array):   Observation indices.
+
+    Returns:
+        tuple(alpha, beta, log_pairwise_marginals, log_likelihood):
+            alpha ((|T+1| x |S|) array):    Forward log probabilities.
+            beta ((|T+1| x |S|) array):     Backward log probabilities.
+            log_pairwise_marginals ((|T| x |S| x |S|) array):
+                Unnormalized log marginal pairs.
+            log_likelihood:                 Log-likelihood of sequence.
+
+    """
+    T = len(actions)
+    S = len(log_i)
+    # Log probability of each transition step, including the observation
+    # at the ending state: (|T| x |S| x |S|).
+    log_step = (log_t[:, actions, :].transpose(1, 0, 2) +
+                log_o[:, actions, observations].T[:, np.newaxis, :])
+    alpha = np.zeros((T + 1, S))
+    beta = np.zeros((T + 1, S))
+    alpha[0] = log_i
+
+    # Forward.
+    for t in xrange(T):
+        alpha[t + 1] = logsumexp(alpha[t][:, np.newaxis] + log_step[t],
+                                 axis=0)
+
+    # Backward.
+    for t in reversed(xrange(T)):
+        beta[t] = logsumexp(log_step[t] + beta[t + 1], axis=1)
+
+    # Make pairwise marginals
+    pm = (alpha[:T, :, np.newaxis] + log_step +
+          beta[1:, np.newaxis, :])  # BUG: should this be s1 or s
+    return alpha, beta, pm, logsumexp(alpha[T, :])
+
+
 class POMDPPolicy:
     '''
     Based on mbforbes/py-pomdp on github.
@@ -934,6 +988,18 @@ class POMDPPolicy:
         return d
 
 
+def estimate_restart(tup):
+    """Run EM from a random initialization using the given seed.
+
+    Helper function for POMDPModel.estimate.
+
+    """
+    model, history, seed, ll_max_improv = tup
+    np.random.seed(seed)
+    return model.estimate_once(history, random_init=True,
+                               ll_max_improv=ll_max_improv)
+
+
 def main_estimate(tup):
     """Helper function for main."""
     i, history, model, model_name, bic_penalty = tup
@@ -1,8 +1,12 @@
 import unittest
 import json
 import os
+import random
+import collections
 from .. import pomdp
 from .. import policy
+from .. import param
+from .. import history as hist
 
 
 def get_external_policy(exp_name, params, policy_params):
@@ -64,6 +68,67 @@ class TestAITPolicy(unittest.TestCase):
         """
 
 
+class TestWorkerStats(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(__file__), os.pardir, 'config', 'classes2-20_80_cost_0.000001.json'), 'r') as f:
+            d = json.load(f)
+        d.update({'exp': True, 'tell': True, 'utility_type': 'acc',
+                  'p_lose': [0.0], 'p_leave': [0.01],
+                  'p_learn_exp': [0.4], 'p_learn_tell': [0.1]})
+        self.pd = param.Params.from_cmd(d).get_param_dict(sample=False)
+
+    def recount(self, pol, actions):
+        """Recount worker stats from scratch."""
+        n_work = sum(1 for a in actions if a == pol._a_ask)
+        teach_counts = collections.Counter()
+        for i, a in enumerate(actions):
+            if (pol.teach_type == 'exp' and a == pol._a_exp and i > 0 and
+                    actions[i - 1] in pol._quiz_idx):
+                teach_counts[actions[i - 1]] += 1
+            elif pol.teach_type == 'tell' and a in pol._tell_idx:
+                teach_counts[a] += 1
+        test_counts = collections.Counter()
+        for a in reversed(actions):
+            if a not in pol._quiz_idx:
+                break
+            test_counts[a] += 1
+        teach_remaining = tuple(a for a in pol._teach_idx if
+                                teach_counts[a] < pol.n_teach)
+        return {'n_work': n_work,
+                'teach_counts': teach_counts,
+                'test_counts': test_counts,
+                'teach_remaining': teach_remaining,
+                'teach_in_progress': tuple(
+                    a for a in teach_remaining if teach_counts[a] > 0),
+                'test_remaining': tuple(
+                    a for a in pol._quiz_idx if test_counts[a] < pol.n_test)}
+
+    def run_workers(self, pol, n_workers=30, max_t=40):
+        h = hist.History()
+        n_obs = len(pol.model.observations)
+        for _ in xrange(n_workers):
+            h.new_worker()
+            for _ in xrange(max_t):
+                a = random.choice(pol.get_valid_actions(h))
+                h.record(a, random.randrange(n_obs))
+                stats = pol.update_worker_stats(h)
+                expected = self.recount(pol, list(h.actions(-1)))
+                for k in expected:
+                    self.assertEqual(stats[k], expected[k])
+                if pol.model.actions[a].name == 'boot':
+                    break
+
+    def test_worker_stats(self):
+        random.seed(0)
+        for teach_type in ('exp', 'tell', None):
+            for n_test, n_teach in ((1, 1), (2, 3)):
+                pol = policy.Policy(
+                    policy_type='test_and_boot', n_worker_classes=2,
+                    params_gt=self.pd, teach_type=teach_type,
+                    n_teach=n_teach, n_test=n_test, n_work=3,
+                    accuracy=0.7)
+                self.run_workers(pol)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,14 @@
+import os
+import copy
+import json
 import unittest
+import numpy as np
+import numpy.testing as npt
+import scipy.stats as ss
 
 from .. import pomdp
+from .. import param
+from .. import history as hist
 
 class TestPolicyImport(unittest.TestCase):
     def test_import(self):
@@ -29,6 +37,107 @@ class TestPolicyImport(unittest.TestCase):
         print p.get_action_rewards([0.0, 0.8, 0.2, 0.0])
 
 
+class TestEstimateE(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(__file__), os.pardir, 'config', 'classes2-20_80_cost_0.000001.json'), 'r') as f:
+            d = json.load(f)
+        d.update({'exp': True, 'utility_type': 'acc',
+                  'p_lose': [0.0], 'p_leave': [0.01],
+                  'p_learn_exp': [0.4], 'p_learn_tell': [0.1]})
+        self.pd = param.Params.from_cmd(d).get_param_dict(sample=False)
+        self.model = pomdp.POMDPModel(
+            2, params=self.pd, hyperparams=param.HyperParams(self.pd, 2),
+            estimate_all=True)
+
+        # Sample workers from the true model, with workers that have no
+        # actions in the middle and at the end.
+        np.random.seed(0)
+        gt = pomdp.POMDPModel(2, params=self.pd)
+        term = gt.observations.index('term')
+        self.history = hist.History()
+        for w in xrange(6):
+            self.history.new_worker()
+            if w in (2, 5):
+                continue
+            b = gt.get_start_belief()
+            s = np.random.choice(len(b), p=b)
+            for t in xrange(8):
+                a = np.random.randint(len(gt.actions))
+                s, o, _, _ = gt.sample_SOR(s, a)
+                self.history.record(a, o)
+                if o == term:
+                    break
+
+        self.params = dict(
+            (p, np.random.dirichlet(self.model.hyperparams.p[p])) for
+            p in self.model.params if p not in self.model.params_fixed)
+
+    def direct_E(self, params):
+        """Compute expected sufficient statistics with explicit loops."""
+        model = self.model
+        S = len(model.states)
+        A = len(model.actions)
+        O = len(model.observations)
+        ess_t = np.zeros((S, A, S))
+        ess_o = np.zeros((S, A, O))
+        ess_i = np.zeros(S)
+        ll = 0
+        start = model.get_start_belief(params)
+        for worker in xrange(self.history.n_workers()):
+            steps = self.history.history[worker]
+            if len(steps) == 0:
+                continue
+            T = len(steps)
+            step = np.zeros((T, S, S))
+            for t, (a, o, _) in enumerate(steps):
+                for s in xrange(S):
+                    for s1 in xrange(S):
+                        step[t, s, s1] = (
+                            model.get_transition(s, a, s1, params) *
+                            model.get_observation(s1, a, o, params))
+            alpha = np.zeros((T + 1, S))
+            beta = np.ones((T + 1, S))
+            alpha[0] = start
+            for t in xrange(T):
+                alpha[t + 1] = alpha[t].dot(step[t])
+            for t in reversed(xrange(T)):
+                beta[t] = step[t].dot(beta[t + 1])
+            likelihood = alpha[T].sum()
+            ll += np.log(likelihood)
+            marginals = alpha * beta / likelihood
+            ess_i += marginals[0]
+            for t, (a, o, _) in enumerate(steps):
+                ess_t[:, a, :] += (alpha[t][:, np.newaxis] * step[t] *
+                                   beta[t + 1]) / likelihood
+                ess_o[:, a, o] += marginals[t + 1]
+        for p in params:
+            ll += np.log(ss.dirichlet.pdf(params[p],
+                                          self.model.hyperparams.p[p]))
+        return ess_t, ess_o, ess_i, ll
+
+    def test_estimate_E(self):
+        ess_t, ess_o, ess_i, ll = self.model.estimate_E(self.history,
+                                                        self.params)
+        ess_t2, ess_o2, ess_i2, ll2 = self.direct_E(self.params)
+        npt.assert_allclose(ess_t, ess_t2, atol=1e-10)
+        npt.assert_allclose(ess_o, ess_o2, atol=1e-10)
+        npt.assert_allclose(ess_i, ess_i2, atol=1e-10)
+        npt.assert_allclose(ll, ll2)
+        # One start per worker with actions.
+        npt.assert_almost_equal(ess_i.sum(), 4)
+
+    def test_estimate_parallel(self):
+        np.random.seed(1)
+        seeds = np.random.randint(np.iinfo(np.int32).max, size=2)
+        lls = [pomdp.estimate_restart(
+            (copy.deepcopy(self.model), self.history, seed, 0.001))[2] for
+               seed in seeds]
+
+        np.random.seed(1)
+        ll, _ = self.model.estimate(self.history, last_params=False,
+                                    random_restarts=2, processes=2)
+        npt.assert_allclose(ll, max(lls))
+
 
 if __name__ == '__main__':
     unittest.main()